@@ -1,11 +1,47 @@
+import asyncio
 import anthropic
-from typing import List, Optional
+import orjson
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+class _OrjsonAsyncHttpxClient(anthropic.DefaultAsyncHttpxClient):
+    """SDK default httpx client that encodes JSON request bodies with orjson"""
+
+    def build_request(self, *args, json=None, **kwargs):
+        # The SDK already sends Content-Type: application/json
+        if json is not None:
+            kwargs["content"] = orjson.dumps(json)
+        return super().build_request(*args, **kwargs)
+
+
+# One client per API key so every AIGenerator shares its HTTP connection pool
+_CLIENT_CACHE: Dict[str, anthropic.AsyncAnthropic] = {}
+
+
+def _get_client(api_key: str) -> anthropic.AsyncAnthropic:
+    """Return the shared Anthropic client for an API key, creating it on first use"""
+    client = _CLIENT_CACHE.get(api_key)
+    if client is None:
+        client = anthropic.AsyncAnthropic(
+            api_key=api_key,
+            default_headers={"anthropic-beta": "prompt-caching-2024-07-31"},
+            http_client=_OrjsonAsyncHttpxClient()
+        )
+        _CLIENT_CACHE[api_key] = client
+    return client
+
 
 class AIGenerator:
     """Handles interactions with Anthropic's Claude API for generating responses"""
 
     MAX_TOOL_ROUNDS = 2
 
+    # Shared tool_choice payloads; the SDK only reads them
+    _TOOL_CHOICE_AUTO = {"type": "auto"}
+    _TOOL_CHOICE_NONE = {"type": "none"}
+
+    # Label for the uncached conversation-history system block
+    _HISTORY_PREFIX = "Previous conversation:\n"
+
     # Static system prompt to avoid rebuilding on each call
     SYSTEM_PROMPT = """ You are an AI assistant specialized in course materials and educational content with access to a comprehensive search tool for course information.
 
@@ -33,20 +69,33 @@ Provide only the direct answer to what was asked.
 """
 
     def __init__(self, api_key: str, model: str):
-        self.client = anthropic.Anthropic(api_key=api_key)
+        self.client = _get_client(api_key)
         self.model = model
 
+        # Static system prompt marked as a cache breakpoint so repeat calls
+        # (later turns and tool rounds) read it from Anthropic's prompt cache
+        self._cached_system_block = [{
+            "type": "text",
+            "text": self.SYSTEM_PROMPT,
+            "cache_control": {"type": "ephemeral"}
+        }]
+
         # Pre-build base API parameters
         self.base_params = {
             "model": self.model,
             "temperature": 0,
             "max_tokens": 800
         }
+        self._base_params_items = tuple(self.base_params.items())
+
+        # (tools passed in, copy with cache breakpoint) from the last call
+        self._cached_tools: Optional[Tuple[List, List]] = None
 
-    def generate_response(self, query: str,
-                         conversation_history: Optional[str] = None,
-                         tools: Optional[List] = None,
-                         tool_manager=None) -> str:
+    async def generate_response(self, query: str,
+                                conversation_history: Optional[str] = None,
+                                tools: Optional[List] = None,
+                                tool_manager=None,
+                                sources: Optional[List[str]] = None) -> str:
         """
         Generate AI response with optional tool usage and conversation context.
 
@@ -55,85 +104,185 @@ Provide only the direct answer to what was asked.
             conversation_history: Previous messages for context
             tools: Available tools the AI can use
             tool_manager: Manager to execute tools
+            sources: Optional per-request list that receives the sources
+                reported by executed tools, in call order without duplicates
 
         Returns:
             Generated response as string
         """
+        async for kind, value in self._run_tool_rounds(
+            query, conversation_history, tools, tool_manager, sources
+        ):
+            # Preamble text sent alongside tool calls is not part of the answer
+            if kind == "answer":
+                return value
+            if kind == "synthesize":
+                final_response = await self.client.messages.create(**value)
+                return self._extract_text(final_response.content)
+
+    async def generate_response_stream(self, query: str,
+                                       conversation_history: Optional[str] = None,
+                                       tools: Optional[List] = None,
+                                       tool_manager=None,
+                                       sources: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, str]]:
+        """
+        Generate AI response like generate_response, yielding text as it arrives.
+
+        Tool rounds still wait for complete messages since tool dispatch needs
+        the full content; only the final synthesis call is streamed. Text that
+        Claude sends alongside tool calls is yielded before the tools run, and
+        an answer produced without a synthesis call is yielded as one chunk.
+        Tool sources are added to `sources` as in generate_response.
+
+        Yields:
+            ("preamble", text) for text sent alongside tool calls, which is not
+            part of the answer, and ("text", chunk) for each answer chunk
+        """
+        async for kind, value in self._run_tool_rounds(
+            query, conversation_history, tools, tool_manager, sources
+        ):
+            if kind == "preamble":
+                yield "preamble", value
+            elif kind == "answer":
+                yield "text", value
+            else:
+                async with self.client.messages.stream(**value) as stream:
+                    async for chunk in stream.text_stream:
+                        yield "text", chunk
+
+    async def _run_tool_rounds(self, query: str,
+                               conversation_history: Optional[str],
+                               tools: Optional[List],
+                               tool_manager,
+                               sources: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Run the tool-calling loop shared by the blocking and streaming paths.
 
-        # Build system content efficiently - avoid string ops when possible
+        Yields:
+            ("preamble", text) for text sent alongside tool calls, before the
+            tools run; then either ("answer", text) when Claude answered within
+            the loop, or ("synthesize", final_params) when a final synthesis
+            call is still needed
+        """
+
+        # Cached prompt prefix first; variable history follows uncached
         system_content = (
-            f"{self.SYSTEM_PROMPT}\n\nPrevious conversation:\n{conversation_history}"
+            [*self._cached_system_block,
+             {"type": "text", "text": self._HISTORY_PREFIX + conversation_history}]
             if conversation_history
-            else self.SYSTEM_PROMPT
+            else self._cached_system_block
         )
 
         messages = [{"role": "user", "content": query}]
 
         # Prepare API call parameters
-        api_params = {
-            **self.base_params,
-            "messages": messages,
-            "system": system_content
-        }
+        api_params = dict(self._base_params_items, messages=messages, system=system_content)
 
         # Add tools if available
         if tools:
-            api_params["tools"] = tools
-            api_params["tool_choice"] = {"type": "auto"}
+            api_params["tools"] = self._cacheable_tools(tools)
+            api_params["tool_choice"] = self._TOOL_CHOICE_AUTO
 
         for _ in range(self.MAX_TOOL_ROUNDS):
-            response = self.client.messages.create(**api_params)
+            self._mark_last_cacheable(messages)
+            response = await self.client.messages.create(**api_params)
 
             # Termination B: natural end (no tool use or no tool_manager)
             if response.stop_reason != "tool_use" or not tool_manager:
-                return response.content[0].text
+                yield "answer", self._extract_text(response.content)
+                return
 
-            tool_results, had_error = self._execute_tool_calls(response, tool_manager)
+            preamble = self._extract_text(response.content)
+            if preamble:
+                yield "preamble", preamble
+
+            tool_results, had_error = await self._execute_tool_calls(response, tool_manager, sources)
             messages.append({"role": "assistant", "content": response.content})
             messages.append({"role": "user", "content": tool_results})
-            api_params["messages"] = messages  # keep tools for next round
 
             if had_error:
                 break  # Termination C: tool failure
 
         # Termination A: rounds exhausted (or C: tool error)
-        # Make final synthesis call WITHOUT tools
-        final_params = {
-            **self.base_params,
-            "messages": messages,
-            "system": system_content
-        }
-        final_response = self.client.messages.create(**final_params)
-        return final_response.content[0].text
+        # Final synthesis call keeps the tool definitions so the cached tool
+        # prefix is reused, but tool_choice "none" forces a text answer
+        api_params["tool_choice"] = self._TOOL_CHOICE_NONE
+        self._mark_last_cacheable(messages)
+        yield "synthesize", api_params
+
+    def _cacheable_tools(self, tools: List) -> List:
+        """
+        Return tools with a cache breakpoint on the last definition.
+
+        The breakpoint caches the whole tool-definition block. The copy leaves
+        the caller's list untouched and is reused while the caller keeps
+        passing the same list, so every call sends an identical tool block.
+        """
+        cached = self._cached_tools
+        if cached is None or cached[0] is not tools:
+            cached = self._cached_tools = (tools, [
+                *tools[:-1],
+                {**tools[-1], "cache_control": {"type": "ephemeral"}}
+            ])
+        return cached[1]
 
-    def _execute_tool_calls(self, response, tool_manager):
+    @staticmethod
+    def _extract_text(content) -> str:
+        """Join the text blocks of a response, skipping tool_use and other blocks"""
+        return "".join(block.text for block in content if block.type == "text")
+
+    @staticmethod
+    def _mark_last_cacheable(messages):
+        """
+        Move the ephemeral cache breakpoint to the last block of the last message.
+
+        Only one breakpoint is kept in the message list so the growing
+        conversation prefix is cached without exceeding the API's limit.
+        Plain-string content (the initial user query) is left as is.
         """
-        Execute all tool calls from a response.
+        for message in messages[:-1]:
+            content = message["content"]
+            if isinstance(content, list) and content and isinstance(content[-1], dict):
+                content[-1].pop("cache_control", None)
+
+        content = messages[-1]["content"]
+        if isinstance(content, list) and content and isinstance(content[-1], dict):
+            content[-1]["cache_control"] = {"type": "ephemeral"}
+
+    async def _execute_tool_calls(self, response, tool_manager, sources: Optional[List[str]] = None):
+        """
+        Execute all tool calls from a response concurrently.
+
+        Tool calls within one response are independent, so each runs in a
+        worker thread and the round takes as long as the slowest tool.
+        Sources are added to `sources` in call order, whatever order the
+        threads finish in.
 
         Returns:
             (tool_results: list, had_error: bool)
         """
+        tool_blocks = [block for block in response.content if block.type == "tool_use"]
+        outputs = await asyncio.gather(
+            *(asyncio.to_thread(tool_manager.execute_tool, block.name, **block.input)
+              for block in tool_blocks),
+            return_exceptions=True
+        )
+
         tool_results = []
         had_error = False
 
-        for content_block in response.content:
-            if content_block.type == "tool_use":
-                try:
-                    tool_result = tool_manager.execute_tool(
-                        content_block.name,
-                        **content_block.input
-                    )
-                    tool_results.append({
-                        "type": "tool_result",
-                        "tool_use_id": content_block.id,
-                        "content": tool_result
-                    })
-                except Exception as e:
-                    tool_results.append({
-                        "type": "tool_result",
-                        "tool_use_id": content_block.id,
-                        "content": f"Tool execution error: {e}"
-                    })
-                    had_error = True
+        for content_block, output in zip(tool_blocks, outputs):
+            if isinstance(output, Exception):
+                output = f"Tool execution error: {output}"
+                had_error = True
+            else:
+                output, tool_sources = output
+                if sources is not None:
+                    sources.extend(source for source in tool_sources if source not in sources)
+            tool_results.append({
+                "type": "tool_result",
+                "tool_use_id": content_block.id,
+                "content": output
+            })
 
         return tool_results, had_error
@@ -1,4 +1,4 @@
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Any, AsyncIterator
 import os
 from document_processor import DocumentProcessor
 from vector_store import VectorStore
@@ -101,7 +101,19 @@ class RAGSystem:
         
         return total_courses, total_chunks
     
-    def query(self, query: str, session_id: Optional[str] = None) -> Tuple[str, List[str]]:
+    def _prepare_query(self, query: str, session_id: Optional[str]) -> Tuple[str, Optional[str]]:
+        """Build the prompt and fetch conversation history shared by query() and query_stream()"""
+        # Create prompt for the AI with clear instructions
+        prompt = f"""Answer this question about course materials: {query}"""
+        
+        # Get conversation history if session exists
+        history = None
+        if session_id:
+            history = self.session_manager.get_conversation_history(session_id)
+        
+        return prompt, history
+    
+    async def query(self, query: str, session_id: Optional[str] = None) -> Tuple[str, List[str]]:
         """
         Process a user query using the RAG system with tool-based search.
         
@@ -112,28 +124,19 @@ class RAGSystem:
         Returns:
             Tuple of (response, sources list - empty for tool-based approach)
         """
-        # Create prompt for the AI with clear instructions
-        prompt = f"""Answer this question about course materials: {query}"""
+        prompt, history = self._prepare_query(query, session_id)
         
-        # Get conversation history if session exists
-        history = None
-        if session_id:
-            history = self.session_manager.get_conversation_history(session_id)
-        
-        # Generate response using AI with tools
-        response = self.ai_generator.generate_response(
+        # Generate response using AI with tools; sources are collected per
+        # request since the tool manager is shared by concurrent queries
+        sources = []
+        response = await self.ai_generator.generate_response(
             query=prompt,
             conversation_history=history,
             tools=self.tool_manager.get_tool_definitions(),
-            tool_manager=self.tool_manager
+            tool_manager=self.tool_manager,
+            sources=sources
         )
         
-        # Get sources from the search tool
-        sources = self.tool_manager.get_last_sources()
-
-        # Reset sources after retrieving them
-        self.tool_manager.reset_sources()
-        
         # Update conversation history
         if session_id:
             self.session_manager.add_exchange(session_id, query, response)
@@ -141,6 +144,43 @@ class RAGSystem:
         # Return response with sources from tool searches
         return response, sources
     
+    async def query_stream(self, query: str, session_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a user query like query(), streaming the answer as it is generated.
+        
+        Args:
+            query: User's question
+            session_id: Optional session ID for conversation context
+            
+        Yields:
+            {"type": "preamble", "text": ...} events for text Claude sends while
+            calling tools and {"type": "text", "text": ...} events for each answer
+            chunk, then a final {"type": "sources", "sources": [...]} event.
+            Only the answer chunks are stored in history, matching query()
+        """
+        prompt, history = self._prepare_query(query, session_id)
+        
+        chunks = []
+        sources = []
+        try:
+            async for kind, chunk in self.ai_generator.generate_response_stream(
+                query=prompt,
+                conversation_history=history,
+                tools=self.tool_manager.get_tool_definitions(),
+                tool_manager=self.tool_manager,
+                sources=sources
+            ):
+                if kind == "text":
+                    chunks.append(chunk)
+                yield {"type": kind, "text": chunk}
+        finally:
+            # Also runs when the client disconnects or generation fails
+            # mid-stream, keeping whatever answer the user already saw
+            if session_id and chunks:
+                self.session_manager.add_exchange(session_id, query, "".join(chunks))
+        
+        yield {"type": "sources", "sources": sources}
+    
     def get_course_analytics(self) -> Dict:
         """Get analytics about the course catalog"""
         return {
@@ -1,18 +1,46 @@
 import sys
 import os
+import types
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 
 # Add the backend directory to sys.path so test files can import backend modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Heavy libraries that backend modules import only for vector storage and
+# embeddings. Unit tests replace those components with mocks, so lightweight
+# stub modules stand in for them and collection skips importing chromadb and
+# torch. Set RAG_TESTS_REAL_DEPS=1 to import the real packages instead.
+_STUBBED_MODULES = {
+    "chromadb": ["PersistentClient", "utils"],
+    "chromadb.config": ["Settings"],
+    "sentence_transformers": ["SentenceTransformer"],
+}
+
+if not os.environ.get("RAG_TESTS_REAL_DEPS"):
+    for _name, _attrs in _STUBBED_MODULES.items():
+        _module = types.ModuleType(_name)
+        for _attr in _attrs:
+            setattr(_module, _attr, MagicMock(name=f"{_name}.{_attr}"))
+        sys.modules[_name] = _module
+    sys.modules["chromadb"].config = sys.modules["chromadb.config"]
+
+import ai_generator  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clear_anthropic_client_cache():
+    """Keep patched Anthropic clients from leaking between tests via the shared client cache."""
+    yield
+    ai_generator._CLIENT_CACHE.clear()
+
 
 @pytest.fixture
 def mock_rag_system():
     """Return a MagicMock that mimics the RAGSystem interface."""
     mock = MagicMock()
     mock.add_course_folder.return_value = (0, 0)
-    mock.query.return_value = ("Mock answer", [])
+    mock.query = AsyncMock(return_value=("Mock answer", []))
     mock.get_course_analytics.return_value = {
         "total_courses": 0,
         "course_titles": [],
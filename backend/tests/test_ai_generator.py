@@ -1,35 +1,79 @@
-from unittest.mock import MagicMock, patch
-from ai_generator import AIGenerator
+import anthropic
+import asyncio
+import httpx
+import threading
+from dataclasses import dataclass, field
+from unittest.mock import AsyncMock, MagicMock, patch
+import ai_generator
+from ai_generator import AIGenerator, _OrjsonAsyncHttpxClient
+
+
+@dataclass
+class FakeTextBlock:
+    text: str
+    type: str = "text"
+
+
+@dataclass
+class FakeThinkingBlock:
+    thinking: str = ""
+    type: str = "thinking"
+
+
+@dataclass
+class FakeToolUseBlock:
+    name: str
+    input: dict
+    id: str
+    type: str = "tool_use"
+
+
+@dataclass
+class FakeResponse:
+    """Plain stand-in for an Anthropic Message; only the attributes AIGenerator reads."""
+    stop_reason: str
+    content: list = field(default_factory=list)
 
 
 def make_text_response(text="Some response"):
-    response = MagicMock()
-    response.stop_reason = "end_turn"
-    content_block = MagicMock()
-    content_block.text = text
-    response.content = [content_block]
-    return response
+    return FakeResponse(stop_reason="end_turn", content=[FakeTextBlock(text)])
 
 
 def make_tool_use_response(tool_name="search_course_content", tool_input=None, tool_id="toolu_01"):
-    response = MagicMock()
-    response.stop_reason = "tool_use"
-    content_block = MagicMock()
-    content_block.type = "tool_use"
-    content_block.name = tool_name
-    content_block.input = tool_input or {"query": "test query"}
-    content_block.id = tool_id
-    response.content = [content_block]
-    return response
+    block = FakeToolUseBlock(name=tool_name, input=tool_input or {"query": "test query"}, id=tool_id)
+    return FakeResponse(stop_reason="tool_use", content=[block])
+
+
+class FakeMessageStream:
+    """Async context manager standing in for client.messages.stream(...)."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @property
+    async def text_stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+async def collect_stream(agen):
+    return [chunk async for chunk in agen]
 
 
 class TestAIGeneratorGenerateResponse:
 
     def setup_method(self):
-        with patch("ai_generator.anthropic.Anthropic"):
+        with patch.object(ai_generator.anthropic, "AsyncAnthropic"):
             self.generator = AIGenerator(api_key="test-key", model="claude-test")
         # self.generator.client is the MagicMock instance created during __init__
         self.mock_client = self.generator.client
+        self.mock_client.messages.create = AsyncMock()
 
     # --- tools parameter in API call ---
 
@@ -37,17 +81,46 @@ class TestAIGeneratorGenerateResponse:
         tools = [{"name": "search_course_content", "description": "Search"}]
         self.mock_client.messages.create.return_value = make_text_response()
 
-        self.generator.generate_response(query="test", tools=tools, tool_manager=MagicMock())
+        asyncio.run(self.generator.generate_response(query="test", tools=tools, tool_manager=MagicMock()))
 
         call_kwargs = self.mock_client.messages.create.call_args.kwargs
         assert "tools" in call_kwargs
         assert "tool_choice" in call_kwargs
-        assert call_kwargs["tools"] == tools
+        assert call_kwargs["tools"] == [
+            {"name": "search_course_content", "description": "Search",
+             "cache_control": {"type": "ephemeral"}}
+        ]
+
+    def test_generate_response_marks_only_last_tool_as_cacheable(self):
+        tools = [{"name": "search_course_content"}, {"name": "get_course_outline"}]
+        self.mock_client.messages.create.return_value = make_text_response()
+
+        asyncio.run(self.generator.generate_response(query="test", tools=tools, tool_manager=MagicMock()))
+
+        sent_tools = self.mock_client.messages.create.call_args.kwargs["tools"]
+        assert "cache_control" not in sent_tools[0]
+        assert sent_tools[-1]["cache_control"] == {"type": "ephemeral"}
+        # Caller's tool definitions are not mutated
+        assert "cache_control" not in tools[-1]
+
+    def test_cacheable_tool_list_is_reused_for_the_same_tools(self):
+        tools = [{"name": "search_course_content"}]
+        self.mock_client.messages.create.return_value = make_text_response()
+
+        asyncio.run(self.generator.generate_response(query="first", tools=tools, tool_manager=MagicMock()))
+        asyncio.run(self.generator.generate_response(query="second", tools=tools, tool_manager=MagicMock()))
+        asyncio.run(self.generator.generate_response(
+            query="third", tools=[{"name": "get_course_outline"}], tool_manager=MagicMock()
+        ))
+
+        calls = self.mock_client.messages.create.call_args_list
+        assert calls[0].kwargs["tools"] is calls[1].kwargs["tools"]
+        assert calls[2].kwargs["tools"][0]["name"] == "get_course_outline"
 
     def test_generate_response_no_tools_param_when_tools_is_none(self):
         self.mock_client.messages.create.return_value = make_text_response()
 
-        self.generator.generate_response(query="test", tools=None)
+        asyncio.run(self.generator.generate_response(query="test", tools=None))
 
         call_kwargs = self.mock_client.messages.create.call_args.kwargs
         assert "tools" not in call_kwargs
@@ -58,7 +131,7 @@ class TestAIGeneratorGenerateResponse:
     def test_generate_response_returns_text_when_no_tool_use(self):
         self.mock_client.messages.create.return_value = make_text_response("Direct answer")
 
-        result = self.generator.generate_response(query="test")
+        result = asyncio.run(self.generator.generate_response(query="test"))
 
         assert result == "Direct answer"
 
@@ -70,9 +143,9 @@ class TestAIGeneratorGenerateResponse:
         self.mock_client.messages.create.side_effect = [tool_response, final_response]
 
         tool_manager = MagicMock()
-        tool_manager.execute_tool.return_value = "search results"
+        tool_manager.execute_tool.return_value = ("search results", [])
 
-        result = self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager)
+        result = asyncio.run(self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager))
 
         assert self.mock_client.messages.create.call_count == 2
         assert result == "Final answer after tool"
@@ -86,27 +159,27 @@ class TestAIGeneratorGenerateResponse:
         self.mock_client.messages.create.side_effect = [tool_response, final_response]
 
         tool_manager = MagicMock()
-        tool_manager.execute_tool.return_value = "results"
+        tool_manager.execute_tool.return_value = ("results", [])
 
-        self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager)
+        asyncio.run(self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager))
 
         tool_manager.execute_tool.assert_called_once_with("search_course_content", **tool_input)
 
-    def test_final_synthesis_call_has_no_tools(self):
-        # Two tool rounds → final synthesis call (3rd) has no tools
+    def test_final_synthesis_call_disables_tool_use(self):
+        # Two tool rounds → final synthesis call (3rd) keeps tools cached but cannot use them
         tool_response_1 = make_tool_use_response(tool_id="toolu_01")
         tool_response_2 = make_tool_use_response(tool_id="toolu_02")
         final_response = make_text_response("Final")
         self.mock_client.messages.create.side_effect = [tool_response_1, tool_response_2, final_response]
 
         tool_manager = MagicMock()
-        tool_manager.execute_tool.return_value = "results"
+        tool_manager.execute_tool.return_value = ("results", [])
 
-        self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager)
+        asyncio.run(self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager))
 
         last_call_kwargs = self.mock_client.messages.create.call_args_list[-1].kwargs
-        assert "tools" not in last_call_kwargs
-        assert "tool_choice" not in last_call_kwargs
+        assert "tools" in last_call_kwargs
+        assert last_call_kwargs["tool_choice"] == {"type": "none"}
 
     def test_handle_tool_execution_appends_tool_result_as_user_message(self):
         tool_response = make_tool_use_response(tool_id="toolu_xyz")
@@ -114,9 +187,9 @@ class TestAIGeneratorGenerateResponse:
         self.mock_client.messages.create.side_effect = [tool_response, final_response]
 
         tool_manager = MagicMock()
-        tool_manager.execute_tool.return_value = "tool result content"
+        tool_manager.execute_tool.return_value = ("tool result content", [])
 
-        self.generator.generate_response(query="user query", tools=[{}], tool_manager=tool_manager)
+        asyncio.run(self.generator.generate_response(query="user query", tools=[{}], tool_manager=tool_manager))
 
         second_call_kwargs = self.mock_client.messages.create.call_args_list[1].kwargs
         messages = second_call_kwargs["messages"]
@@ -133,26 +206,63 @@ class TestAIGeneratorGenerateResponse:
         assert tool_results[0]["tool_use_id"] == "toolu_xyz"
         assert tool_results[0]["content"] == "tool result content"
 
+    def test_last_tool_result_is_marked_cacheable(self):
+        tool_response = make_tool_use_response(tool_id="toolu_xyz")
+        final_response = make_text_response("Final")
+        self.mock_client.messages.create.side_effect = [tool_response, final_response]
+
+        tool_manager = MagicMock()
+        tool_manager.execute_tool.return_value = ("tool result content", [])
+
+        asyncio.run(self.generator.generate_response(query="user query", tools=[{}], tool_manager=tool_manager))
+
+        messages = self.mock_client.messages.create.call_args_list[1].kwargs["messages"]
+        assert messages[0]["content"] == "user query"
+        assert messages[-1]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+
+    def test_only_latest_tool_result_keeps_cache_breakpoint(self):
+        tool_response_1 = make_tool_use_response(tool_id="toolu_01")
+        tool_response_2 = make_tool_use_response(tool_id="toolu_02")
+        final_response = make_text_response("Final")
+        self.mock_client.messages.create.side_effect = [tool_response_1, tool_response_2, final_response]
+
+        tool_manager = MagicMock()
+        tool_manager.execute_tool.return_value = ("results", [])
+
+        asyncio.run(self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager))
+
+        final_call_messages = self.mock_client.messages.create.call_args_list[-1].kwargs["messages"]
+        assert "cache_control" not in final_call_messages[2]["content"][-1]
+        assert final_call_messages[4]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+
     # --- System prompt / conversation history ---
 
     def test_generate_response_builds_system_with_history(self):
         self.mock_client.messages.create.return_value = make_text_response()
         history = "User: Hello\nAssistant: Hi"
 
-        self.generator.generate_response(query="test", conversation_history=history)
+        asyncio.run(self.generator.generate_response(query="test", conversation_history=history))
 
         call_kwargs = self.mock_client.messages.create.call_args.kwargs
         system = call_kwargs["system"]
-        assert AIGenerator.SYSTEM_PROMPT in system
-        assert history in system
+        assert isinstance(system, list)
+        assert len(system) == 2
+        assert system[0]["text"] == AIGenerator.SYSTEM_PROMPT
+        assert system[0]["cache_control"] == {"type": "ephemeral"}
+        assert history in system[1]["text"]
+        assert "cache_control" not in system[1]
 
     def test_generate_response_uses_base_prompt_when_no_history(self):
         self.mock_client.messages.create.return_value = make_text_response()
 
-        self.generator.generate_response(query="test", conversation_history=None)
+        asyncio.run(self.generator.generate_response(query="test", conversation_history=None))
 
         call_kwargs = self.mock_client.messages.create.call_args.kwargs
-        assert call_kwargs["system"] == AIGenerator.SYSTEM_PROMPT
+        assert call_kwargs["system"] == [{
+            "type": "text",
+            "text": AIGenerator.SYSTEM_PROMPT,
+            "cache_control": {"type": "ephemeral"},
+        }]
 
     # --- Two-round tool calling (new behavior) ---
 
@@ -163,9 +273,9 @@ class TestAIGeneratorGenerateResponse:
         self.mock_client.messages.create.side_effect = [tool_response_1, tool_response_2, final_response]
 
         tool_manager = MagicMock()
-        tool_manager.execute_tool.return_value = "tool output"
+        tool_manager.execute_tool.return_value = ("tool output", [])
 
-        result = self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager)
+        result = asyncio.run(self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager))
 
         assert self.mock_client.messages.create.call_count == 3
         assert tool_manager.execute_tool.call_count == 2
@@ -178,14 +288,15 @@ class TestAIGeneratorGenerateResponse:
         self.mock_client.messages.create.side_effect = [tool_response_1, tool_response_2, final_response]
 
         tool_manager = MagicMock()
-        tool_manager.execute_tool.return_value = "results"
+        tool_manager.execute_tool.return_value = ("results", [])
         tools = [{"name": "search_course_content"}]
 
-        self.generator.generate_response(query="test", tools=tools, tool_manager=tool_manager)
+        asyncio.run(self.generator.generate_response(query="test", tools=tools, tool_manager=tool_manager))
 
         # First two calls (loop rounds) include tools
         assert "tools" in self.mock_client.messages.create.call_args_list[0].kwargs
         assert "tools" in self.mock_client.messages.create.call_args_list[1].kwargs
+        assert self.mock_client.messages.create.call_args_list[1].kwargs["tool_choice"] == {"type": "auto"}
 
     def test_two_tool_rounds_message_list_grows_correctly(self):
         # After 2 tool rounds, final synthesis call receives 5 messages:
@@ -196,9 +307,9 @@ class TestAIGeneratorGenerateResponse:
         self.mock_client.messages.create.side_effect = [tool_response_1, tool_response_2, final_response]
 
         tool_manager = MagicMock()
-        tool_manager.execute_tool.return_value = "results"
+        tool_manager.execute_tool.return_value = ("results", [])
 
-        self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager)
+        asyncio.run(self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager))
 
         final_call_messages = self.mock_client.messages.create.call_args_list[2].kwargs["messages"]
         assert len(final_call_messages) == 5
@@ -211,7 +322,7 @@ class TestAIGeneratorGenerateResponse:
         tool_manager = MagicMock()
         tool_manager.execute_tool.side_effect = Exception("Tool crashed")
 
-        result = self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager)
+        result = asyncio.run(self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager))
 
         # Loop breaks after error, synthesis call still made
         assert self.mock_client.messages.create.call_count == 2
@@ -222,6 +333,173 @@ class TestAIGeneratorGenerateResponse:
         tool_result_content = synthesis_messages[-1]["content"]
         assert any("Tool execution error" in item["content"] for item in tool_result_content)
 
+    def test_multiple_tool_calls_in_one_response_all_execute_in_order(self):
+        tool_response = make_tool_use_response(tool_id="toolu_01")
+        tool_response.content.append(FakeToolUseBlock(
+            name="get_course_outline", input={"course_title": "Python"}, id="toolu_02"
+        ))
+        final_response = make_text_response("Final")
+        self.mock_client.messages.create.side_effect = [tool_response, final_response]
+
+        tool_manager = MagicMock()
+        tool_manager.execute_tool.side_effect = lambda name, **kwargs: (f"{name} output", [])
+
+        asyncio.run(self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager))
+
+        tool_results = self.mock_client.messages.create.call_args_list[1].kwargs["messages"][-1]["content"]
+        assert [r["tool_use_id"] for r in tool_results] == ["toolu_01", "toolu_02"]
+        assert tool_results[0]["content"] == "search_course_content output"
+        assert tool_results[1]["content"] == "get_course_outline output"
+
+    def test_tool_sources_are_collected_in_call_order_without_duplicates(self):
+        tool_response = make_tool_use_response(tool_input={"query": "slow"}, tool_id="toolu_01")
+        tool_response.content.append(FakeToolUseBlock(
+            name="search_course_content", input={"query": "fast"}, id="toolu_02"
+        ))
+        self.mock_client.messages.create.side_effect = [tool_response, make_text_response("Final")]
+        fast_done = threading.Event()
+
+        def execute_tool(name, query):
+            # The first call finishes last
+            if query == "slow":
+                fast_done.wait(timeout=5)
+                return "slow output", ["Course A", "Course B"]
+            fast_done.set()
+            return "fast output", ["Course B", "Course C"]
+
+        tool_manager = MagicMock()
+        tool_manager.execute_tool.side_effect = execute_tool
+        sources = []
+
+        asyncio.run(self.generator.generate_response(
+            query="test", tools=[{}], tool_manager=tool_manager, sources=sources
+        ))
+
+        assert sources == ["Course A", "Course B", "Course C"]
+
+    def test_generators_with_same_api_key_share_one_client(self):
+        with patch.object(ai_generator.anthropic, "AsyncAnthropic") as mock_client_class:
+            mock_client_class.side_effect = lambda **kwargs: MagicMock()
+            first = AIGenerator(api_key="shared-key", model="claude-test")
+            second = AIGenerator(api_key="shared-key", model="claude-other")
+            other = AIGenerator(api_key="other-key", model="claude-test")
+
+        assert first.client is second.client
+        assert other.client is not first.client
+        assert mock_client_class.call_count == 2
+
+    def test_answer_joins_text_blocks_when_first_block_is_not_text(self):
+        response = make_text_response("Answer")
+        response.content.insert(0, FakeThinkingBlock())
+        self.mock_client.messages.create.return_value = response
+
+        result = asyncio.run(self.generator.generate_response(query="test"))
+
+        assert result == "Answer"
+
+    def test_preamble_text_alongside_tool_call_is_not_returned(self):
+        tool_response = make_tool_use_response()
+        tool_response.content.insert(0, FakeTextBlock("Let me check."))
+        self.mock_client.messages.create.side_effect = [tool_response, make_text_response("Final")]
+
+        tool_manager = MagicMock()
+        tool_manager.execute_tool.return_value = ("results", [])
+
+        result = asyncio.run(self.generator.generate_response(query="test", tools=[{}], tool_manager=tool_manager))
+
+        assert result == "Final"
+        tool_manager.execute_tool.assert_called_once()
+
     def test_system_prompt_allows_up_to_two_tool_calls(self):
         assert "One search per query maximum" not in AIGenerator.SYSTEM_PROMPT
         assert "Up to 2 tool calls per query" in AIGenerator.SYSTEM_PROMPT
+
+
+class TestAIGeneratorGenerateResponseStream:
+
+    def setup_method(self):
+        with patch.object(ai_generator.anthropic, "AsyncAnthropic"):
+            self.generator = AIGenerator(api_key="test-key", model="claude-test")
+        self.mock_client = self.generator.client
+        self.mock_client.messages.create = AsyncMock()
+
+    def test_direct_answer_is_yielded_without_streaming_call(self):
+        self.mock_client.messages.create.return_value = make_text_response("Direct answer")
+
+        chunks = asyncio.run(collect_stream(self.generator.generate_response_stream(query="test")))
+
+        assert chunks == [("text", "Direct answer")]
+        self.mock_client.messages.stream.assert_not_called()
+
+    def test_final_synthesis_is_streamed_after_tool_rounds(self):
+        tool_response_1 = make_tool_use_response(tool_id="toolu_01")
+        tool_response_2 = make_tool_use_response(tool_id="toolu_02")
+        self.mock_client.messages.create.side_effect = [tool_response_1, tool_response_2]
+        self.mock_client.messages.stream.return_value = FakeMessageStream(["Synth", "esized"])
+
+        tool_manager = MagicMock()
+        tool_manager.execute_tool.return_value = ("results", [])
+
+        chunks = asyncio.run(collect_stream(self.generator.generate_response_stream(
+            query="test", tools=[{}], tool_manager=tool_manager
+        )))
+
+        assert chunks == [("text", "Synth"), ("text", "esized")]
+        assert self.mock_client.messages.create.call_count == 2
+        stream_kwargs = self.mock_client.messages.stream.call_args.kwargs
+        assert stream_kwargs["tool_choice"] == {"type": "none"}
+        assert len(stream_kwargs["messages"]) == 5
+
+    def test_preamble_text_is_streamed_separately_before_tools_run(self):
+        tool_response = make_tool_use_response()
+        tool_response.content.insert(0, FakeTextBlock("Let me check. "))
+        self.mock_client.messages.create.side_effect = [tool_response, make_text_response("Final")]
+
+        order = []
+        tool_manager = MagicMock()
+        tool_manager.execute_tool.side_effect = lambda name, **kwargs: order.append("tool") or ("results", [])
+
+        async def collect():
+            async for chunk in self.generator.generate_response_stream(
+                query="test", tools=[{}], tool_manager=tool_manager
+            ):
+                order.append(chunk)
+
+        asyncio.run(collect())
+
+        assert order == [("preamble", "Let me check. "), "tool", ("text", "Final")]
+
+
+class TestOrjsonHttpClient:
+
+    def test_sdk_request_body_is_encoded_compactly_as_utf8(self):
+        captured = []
+
+        def handler(request):
+            captured.append(request)
+            return httpx.Response(200, json={
+                "id": "msg_01", "type": "message", "role": "assistant", "model": "claude-test",
+                "content": [{"type": "text", "text": "ok"}],
+                "stop_reason": "end_turn", "stop_sequence": None,
+                "usage": {"input_tokens": 1, "output_tokens": 1},
+            })
+
+        client = anthropic.AsyncAnthropic(
+            api_key="test-key",
+            http_client=_OrjsonAsyncHttpxClient(transport=httpx.MockTransport(handler)),
+        )
+
+        # The SDK's own encoder yields the same bytes, so also check orjson did the encoding
+        with patch.object(ai_generator.orjson, "dumps", wraps=ai_generator.orjson.dumps) as dumps:
+            asyncio.run(client.messages.create(
+                model="claude-test", max_tokens=10,
+                messages=[{"role": "user", "content": "café"}],
+            ))
+
+        dumps.assert_called_once()
+
+        request = captured[0]
+        assert request.content == (
+            '{"max_tokens":10,"messages":[{"role":"user","content":"café"}],"model":"claude-test"}'.encode()
+        )
+        assert request.headers["content-type"] == "application/json"
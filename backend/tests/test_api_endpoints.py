@@ -9,9 +9,10 @@ import-time failures that cannot be worked around with per-test fixtures:
      credentials and disk state that tests should not touch.
 """
 
+import json
 import sys
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 # Drop any cached copy so the patched import below starts clean.
 sys.modules.pop("app", None)
@@ -26,6 +27,7 @@ _rag_patcher = patch("rag_system.RAGSystem")
 _mock_rag_class = _rag_patcher.start()
 _mock_rag = MagicMock()
 _mock_rag.add_course_folder.return_value = (0, 0)
+_mock_rag.query = AsyncMock()
 _mock_rag_class.return_value = _mock_rag
 
 from fastapi.testclient import TestClient  # noqa: E402
@@ -34,16 +36,18 @@ import app as app_module  # noqa: E402  intentional late import after patches
 _sf_patcher.stop()
 _rag_patcher.stop()
 
-_client = TestClient(app_module.app, raise_server_exceptions=False)
-
 
 # --- shared fixtures ---
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def client():
-    """Return the shared TestClient bound to the patched app."""
-    return _client
+    """Return one TestClient (and its single ASGI transport) shared by every test in the module.
+
+    Server exceptions are not suppressed: every 500 these tests expect is an
+    HTTPException response, so an unhandled error should fail the test.
+    """
+    return TestClient(app_module.app)
 
 
 @pytest.fixture(autouse=True)
@@ -147,6 +151,51 @@ class TestQueryEndpoint:
         assert response.status_code == 422
 
 
+# --- /api/query/stream ---
+
+
+def _fake_query_stream(events):
+    async def stream(query, session_id):
+        for event in events:
+            yield event
+    return stream
+
+
+class TestQueryStreamEndpoint:
+
+    def test_streams_text_and_sources_events(self, client):
+        _mock_rag.session_manager.create_session.return_value = "stream-sess"
+        _mock_rag.query_stream = _fake_query_stream([
+            {"type": "text", "text": "Hello"},
+            {"type": "sources", "sources": ["Source 1"]},
+        ])
+
+        response = client.post("/api/query/stream", json={"query": "test"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [
+            json.loads(line[len("data: "):])
+            for line in response.text.splitlines() if line.startswith("data: ")
+        ]
+        assert events == [
+            {"type": "text", "text": "Hello"},
+            {"type": "sources", "sources": ["Source 1"], "session_id": "stream-sess"},
+        ]
+
+    def test_reports_error_event_when_rag_system_raises(self, client):
+        async def failing_stream(query, session_id):
+            raise Exception("RAG failure")
+            yield
+
+        _mock_rag.query_stream = failing_stream
+
+        response = client.post("/api/query/stream", json={"query": "test", "session_id": "s"})
+
+        assert '"type": "error"' in response.text
+        assert "RAG failure" in response.text
+
+
 # --- /api/courses ---
 
 
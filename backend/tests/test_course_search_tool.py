@@ -1,5 +1,5 @@
 from unittest.mock import MagicMock
-from search_tools import CourseSearchTool
+from search_tools import CourseSearchTool, ToolManager
 from vector_store import SearchResults
 
 
@@ -75,7 +75,7 @@ class TestCourseSearchToolExecute:
 
     # --- Source link generation ---
 
-    def test_execute_sets_last_sources_with_link(self):
+    def test_execute_with_sources_returns_link(self):
         results = make_results(
             documents=["content"],
             metadata=[{"course_title": "My Course", "lesson_number": 2}],
@@ -83,13 +83,13 @@ class TestCourseSearchToolExecute:
         self.mock_store.search.return_value = results
         self.mock_store.get_lesson_link.return_value = "https://example.com/lesson"
 
-        self.tool.execute(query="test")
+        _, sources = self.tool.execute_with_sources(query="test")
 
-        assert len(self.tool.last_sources) == 1
-        assert 'href="https://example.com/lesson"' in self.tool.last_sources[0]
-        assert "My Course - Lesson 2" in self.tool.last_sources[0]
+        assert len(sources) == 1
+        assert 'href="https://example.com/lesson"' in sources[0]
+        assert "My Course - Lesson 2" in sources[0]
 
-    def test_execute_sets_last_sources_without_link(self):
+    def test_execute_with_sources_without_link(self):
         results = make_results(
             documents=["content"],
             metadata=[{"course_title": "My Course", "lesson_number": 2}],
@@ -97,14 +97,13 @@ class TestCourseSearchToolExecute:
         self.mock_store.search.return_value = results
         self.mock_store.get_lesson_link.return_value = None
 
-        self.tool.execute(query="test")
+        _, sources = self.tool.execute_with_sources(query="test")
 
-        assert len(self.tool.last_sources) == 1
-        assert self.tool.last_sources[0] == "My Course - Lesson 2"
+        assert sources == ["My Course - Lesson 2"]
 
-    # --- Source overwriting ---
+    # --- Sources are per call ---
 
-    def test_execute_overwrites_last_sources_on_each_call(self):
+    def test_execute_with_sources_returns_only_that_calls_sources(self):
         # First call produces two sources
         results1 = make_results(
             documents=["doc1", "doc2"],
@@ -115,19 +114,19 @@ class TestCourseSearchToolExecute:
         )
         self.mock_store.search.return_value = results1
         self.mock_store.get_lesson_link.return_value = None
-        self.tool.execute(query="first query")
-        assert len(self.tool.last_sources) == 2
+        _, sources = self.tool.execute_with_sources(query="first query")
+        assert len(sources) == 2
 
-        # Second call produces one source — should replace, not append
+        # Second call produces one source — nothing carries over from the first
         results2 = make_results(
             documents=["doc3"],
             metadata=[{"course_title": "Course C", "lesson_number": 3}],
         )
         self.mock_store.search.return_value = results2
-        self.tool.execute(query="second query")
+        _, sources = self.tool.execute_with_sources(query="second query")
 
-        assert len(self.tool.last_sources) == 1
-        assert "Course C" in self.tool.last_sources[0]
+        assert len(sources) == 1
+        assert "Course C" in sources[0]
 
     # --- Tool definition structure ---
 
@@ -137,3 +136,21 @@ class TestCourseSearchToolExecute:
         assert "description" in definition
         assert "input_schema" in definition
         assert "query" in definition["input_schema"]["required"]
+
+
+class TestToolManagerDefinitions:
+
+    def test_tool_definitions_are_reused_until_a_tool_is_registered(self):
+        manager = ToolManager()
+        manager.register_tool(CourseSearchTool(MagicMock()))
+
+        first = manager.get_tool_definitions()
+        assert manager.get_tool_definitions() is first
+
+        outline_tool = MagicMock()
+        outline_tool.get_tool_definition.return_value = {"name": "get_course_outline"}
+        manager.register_tool(outline_tool)
+
+        definitions = manager.get_tool_definitions()
+        assert definitions is not first
+        assert [d["name"] for d in definitions] == ["search_course_content", "get_course_outline"]
@@ -1,117 +1,269 @@
+import asyncio
 import pytest
-from unittest.mock import MagicMock, patch
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
+import ai_generator
+from ai_generator import AIGenerator
 from rag_system import RAGSystem
+from search_tools import Tool, ToolManager
+
+
+class _RecordingGenerateResponse:
+    """Async stand-in for AIGenerator.generate_response that records the last call's kwargs
+    and reports `sources` into the caller's per-request list, as the real tool loop does."""
+
+    def __init__(self):
+        self.return_value = None
+        self.sources = []
+        self.kwargs = {}
+
+    async def __call__(self, **kwargs):
+        self.kwargs = kwargs
+        kwargs["sources"].extend(self.sources)
+        return self.return_value
 
 
 @pytest.fixture
-def rag_mocks():
-    """Construct a RAGSystem with all sub-components replaced by MagicMocks."""
-    with (
-        patch("rag_system.DocumentProcessor") as mock_dp,
-        patch("rag_system.VectorStore") as mock_vs,
-        patch("rag_system.AIGenerator") as mock_ai,
-        patch("rag_system.SessionManager") as mock_sm,
-        patch("rag_system.ToolManager") as mock_tm,
-        patch("rag_system.CourseSearchTool") as mock_cst,
-        patch("rag_system.CourseOutlineTool") as mock_cot,
-    ):
-        config = MagicMock()
-        rag = RAGSystem(config)
-        yield {
-            "rag": rag,
-            "mock_ai": mock_ai,
-            "mock_sm": mock_sm,
-            "mock_tm": mock_tm,
-        }
+def rag():
+    """Build a RAGSystem without running __init__, injecting mocks for the components query() uses."""
+    rag = RAGSystem.__new__(RAGSystem)
+    # Pre-attach the methods query() calls as plain stubs with their defaults,
+    # so tests only reassign return_value instead of growing child mocks
+    rag.ai_generator = Mock()
+    rag.ai_generator.generate_response = _RecordingGenerateResponse()
+    rag.tool_manager = Mock()
+    rag.tool_manager.get_tool_definitions = Mock(return_value=[])
+    rag.session_manager = Mock()
+    rag.session_manager.get_conversation_history = Mock(return_value=None)
+    rag.session_manager.add_exchange = Mock()
+    return rag
 
 
-class TestRAGSystemQuery:
+_EXPECTED_TOOLS = [{"name": "search_course_content"}]
+
+
+# --- query() cases: setup(rag) runs before the call, check(rag) after ---
+
+
+def _no_setup(rag):
+    pass
+
+
+def _check_prompt_wraps_query(rag):
+    assert rag.ai_generator.generate_response.kwargs["query"] == "Answer this question about course materials: What is Python?"
+
+
+def _setup_tool_definitions(rag):
+    rag.tool_manager.get_tool_definitions.return_value = _EXPECTED_TOOLS
+
 
-    # --- Prompt construction ---
+def _check_tool_definitions_passed(rag):
+    assert rag.ai_generator.generate_response.kwargs["tools"] == _EXPECTED_TOOLS
 
-    def test_query_wraps_user_query_in_prompt(self, rag_mocks):
-        rag = rag_mocks["rag"]
-        rag.ai_generator.generate_response.return_value = "some answer"
-        rag.tool_manager.get_last_sources.return_value = []
 
-        rag.query("What is Python?")
+def _check_history_untouched(rag):
+    rag.session_manager.get_conversation_history.assert_not_called()
+    rag.session_manager.add_exchange.assert_not_called()
 
-        call_kwargs = rag.ai_generator.generate_response.call_args.kwargs
-        assert call_kwargs["query"] == "Answer this question about course materials: What is Python?"
 
-    def test_query_passes_tool_definitions_to_ai_generator(self, rag_mocks):
-        rag = rag_mocks["rag"]
-        rag.ai_generator.generate_response.return_value = "answer"
-        expected_tools = [{"name": "search_course_content"}]
-        rag.tool_manager.get_tool_definitions.return_value = expected_tools
-        rag.tool_manager.get_last_sources.return_value = []
+def _setup_history(rag):
+    rag.session_manager.get_conversation_history.return_value = "User: Hi\nAssistant: Hello"
 
-        rag.query("test query")
 
-        call_kwargs = rag.ai_generator.generate_response.call_args.kwargs
-        assert call_kwargs["tools"] == expected_tools
+def _check_history_fetched(rag):
+    rag.session_manager.get_conversation_history.assert_called_once_with("session_1")
 
-    # --- Return values ---
 
-    def test_query_returns_response_from_ai_generator(self, rag_mocks):
-        rag = rag_mocks["rag"]
+def _setup_response(rag):
+    rag.ai_generator.generate_response.return_value = "the response"
+
+
+def _check_exchange_stored(rag):
+    # Current behavior: original query (not the wrapped prompt) is stored.
+    # Bug D: the AI received the wrapped prompt, so history will misrepresent
+    # what was actually sent to the model in previous turns.
+    rag.session_manager.add_exchange.assert_called_once_with(
+        "session_1", "original query", "the response"
+    )
+
+
+class TestRAGSystemQuery:
+
+    @pytest.mark.parametrize("query_kwargs, setup, check", [
+        pytest.param({"query": "What is Python?"}, _no_setup, _check_prompt_wraps_query,
+                     id="wraps_user_query_in_prompt"),
+        pytest.param({"query": "test query"}, _setup_tool_definitions, _check_tool_definitions_passed,
+                     id="passes_tool_definitions_to_ai_generator"),
+        pytest.param({"query": "test query", "session_id": None}, _no_setup, _check_history_untouched,
+                     id="without_session_id_skips_history_calls"),
+    ])
+    def test_query_without_session(self, rag, query_kwargs, setup, check):
+        setup(rag)
+
+        asyncio.run(rag.query(**query_kwargs))
+
+        check(rag)
+
+    def test_query_returns_response_and_collected_sources(self, rag):
         rag.ai_generator.generate_response.return_value = "the AI answer"
-        rag.tool_manager.get_last_sources.return_value = []
+        rag.ai_generator.generate_response.sources = ["<a href='...'>Source 1</a>"]
 
-        response, sources = rag.query("test query")
+        response, sources = asyncio.run(rag.query("test query"))
 
         assert response == "the AI answer"
+        assert sources == ["<a href='...'>Source 1</a>"]
 
-    def test_query_retrieves_sources_from_tool_manager(self, rag_mocks):
-        rag = rag_mocks["rag"]
-        rag.ai_generator.generate_response.return_value = "answer"
-        rag.tool_manager.get_last_sources.return_value = ["<a href='...'>Source 1</a>"]
+    def test_concurrent_queries_keep_their_own_sources(self):
+        class EchoTool(Tool):
+            def get_tool_definition(self):
+                return {"name": "search_course_content"}
 
-        response, sources = rag.query("test query")
+            def execute_with_sources(self, query):
+                return f"results for {query}", [f"src-for-{query}"]
 
-        assert sources == ["<a href='...'>Source 1</a>"]
+            def execute(self, query):
+                return self.execute_with_sources(query)[0]
 
-    def test_query_resets_sources_after_retrieval(self, rag_mocks):
-        rag = rag_mocks["rag"]
-        rag.ai_generator.generate_response.return_value = "answer"
-        rag.tool_manager.get_last_sources.return_value = []
+        async def fake_create(**params):
+            # Let the other query reach the same point before either resumes
+            await asyncio.sleep(0)
+            messages = params["messages"]
+            if len(messages) == 1:
+                # The wrapped prompt ends with the user's query
+                block = SimpleNamespace(type="tool_use", id="toolu_01", name="search_course_content",
+                                        input={"query": messages[0]["content"][-1]})
+                return SimpleNamespace(stop_reason="tool_use", content=[block])
+            return SimpleNamespace(stop_reason="end_turn", content=[SimpleNamespace(type="text", text="ans")])
 
-        rag.query("test query")
+        rag = RAGSystem.__new__(RAGSystem)
+        rag.tool_manager = ToolManager()
+        rag.tool_manager.register_tool(EchoTool())
+        rag.session_manager = Mock()
+        with patch.object(ai_generator.anthropic, "AsyncAnthropic"):
+            rag.ai_generator = AIGenerator(api_key="test-key", model="claude-test")
+        rag.ai_generator.client.messages.create = AsyncMock(side_effect=fake_create)
 
-        rag.tool_manager.reset_sources.assert_called_once()
+        async def run_both():
+            return await asyncio.gather(rag.query("A"), rag.query("B"))
 
-    # --- Session history ---
+        results = asyncio.run(run_both())
 
-    def test_query_with_session_id_fetches_history(self, rag_mocks):
-        rag = rag_mocks["rag"]
-        rag.ai_generator.generate_response.return_value = "answer"
-        rag.session_manager.get_conversation_history.return_value = "User: Hi\nAssistant: Hello"
-        rag.tool_manager.get_last_sources.return_value = []
+        assert results == [("ans", ["src-for-A"]), ("ans", ["src-for-B"])]
+
+    @pytest.mark.parametrize("query_kwargs, setup, check", [
+        pytest.param({"query": "test query", "session_id": "session_1"}, _setup_history, _check_history_fetched,
+                     id="fetches_history"),
+        pytest.param({"query": "original query", "session_id": "session_1"}, _setup_response, _check_exchange_stored,
+                     id="stores_exchange"),
+    ])
+    def test_query_with_session(self, rag, query_kwargs, setup, check):
+        setup(rag)
+
+        asyncio.run(rag.query(**query_kwargs))
 
-        rag.query("test query", session_id="session_1")
+        check(rag)
 
-        rag.session_manager.get_conversation_history.assert_called_once_with("session_1")
+    # --- Streaming ---
 
-    def test_query_with_session_id_stores_exchange(self, rag_mocks):
-        rag = rag_mocks["rag"]
-        rag.ai_generator.generate_response.return_value = "the response"
-        rag.tool_manager.get_last_sources.return_value = []
+    def test_query_stream_yields_text_then_sources_and_stores_full_answer(self, rag):
+        async def fake_stream(**kwargs):
+            kwargs["sources"].append("Source 1")
+            for chunk in ["the ", "response"]:
+                yield "text", chunk
 
-        rag.query("original query", session_id="session_1")
+        rag.ai_generator.generate_response_stream = fake_stream
 
-        # Current behavior: original query (not the wrapped prompt) is stored.
-        # Bug D: the AI received the wrapped prompt, so history will misrepresent
-        # what was actually sent to the model in previous turns.
+        async def collect():
+            return [event async for event in rag.query_stream("original query", session_id="session_1")]
+
+        events = asyncio.run(collect())
+
+        assert events == [
+            {"type": "text", "text": "the "},
+            {"type": "text", "text": "response"},
+            {"type": "sources", "sources": ["Source 1"]},
+        ]
         rag.session_manager.add_exchange.assert_called_once_with(
             "session_1", "original query", "the response"
         )
 
-    def test_query_without_session_id_skips_history_calls(self, rag_mocks):
-        rag = rag_mocks["rag"]
-        rag.ai_generator.generate_response.return_value = "answer"
-        rag.tool_manager.get_last_sources.return_value = []
+    def test_query_stream_sends_same_prompt_and_history_as_query(self, rag):
+        rag.session_manager.get_conversation_history.return_value = "User: Hi\nAssistant: Hello"
+        stream_kwargs = {}
+
+        async def fake_stream(**kwargs):
+            stream_kwargs.update(kwargs)
+            yield "text", "the response"
+
+        rag.ai_generator.generate_response_stream = fake_stream
+
+        async def run_both():
+            await rag.query("What is Python?", session_id="session_1")
+            return [event async for event in rag.query_stream("What is Python?", session_id="session_1")]
+
+        asyncio.run(run_both())
 
-        rag.query("test query", session_id=None)
+        query_kwargs = rag.ai_generator.generate_response.kwargs
+        assert stream_kwargs["query"] == query_kwargs["query"]
+        assert stream_kwargs["conversation_history"] == query_kwargs["conversation_history"] == "User: Hi\nAssistant: Hello"
+
+    def test_query_stream_sends_preamble_separately_and_stores_only_the_answer(self, rag):
+        async def fake_stream(**kwargs):
+            yield "preamble", "Let me check that."
+            yield "text", "Python is "
+            yield "text", "a language."
+
+        rag.ai_generator.generate_response_stream = fake_stream
+
+        async def collect():
+            return [event async for event in rag.query_stream("original query", session_id="session_1")]
+
+        events = asyncio.run(collect())
+
+        assert events == [
+            {"type": "preamble", "text": "Let me check that."},
+            {"type": "text", "text": "Python is "},
+            {"type": "text", "text": "a language."},
+            {"type": "sources", "sources": []},
+        ]
+        rag.session_manager.add_exchange.assert_called_once_with(
+            "session_1", "original query", "Python is a language."
+        )
 
-        rag.session_manager.get_conversation_history.assert_not_called()
-        rag.session_manager.add_exchange.assert_not_called()
+    def test_query_stream_stores_partial_answer_when_closed_early(self, rag):
+        async def fake_stream(**kwargs):
+            for chunk in ["the ", "response"]:
+                yield "text", chunk
+
+        rag.ai_generator.generate_response_stream = fake_stream
+
+        async def read_first_then_close():
+            stream = rag.query_stream("original query", session_id="session_1")
+            first = await anext(stream)
+            # What StreamingResponse does when the client disconnects
+            await stream.aclose()
+            return first
+
+        first = asyncio.run(read_first_then_close())
+
+        assert first == {"type": "text", "text": "the "}
+        rag.session_manager.add_exchange.assert_called_once_with(
+            "session_1", "original query", "the "
+        )
+
+    def test_query_stream_stores_partial_answer_when_generation_fails(self, rag):
+        async def fake_stream(**kwargs):
+            yield "text", "the "
+            raise RuntimeError("API down")
+
+        rag.ai_generator.generate_response_stream = fake_stream
+
+        async def collect():
+            return [event async for event in rag.query_stream("original query", session_id="session_1")]
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(collect())
+
+        rag.session_manager.add_exchange.assert_called_once_with(
+            "session_1", "original query", "the "
+        )